@@ -4,16 +4,33 @@ Routes sensor data to Database Pi (192.168.1.100)
 Uses SQLite for offline storage locally
 """
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+import logging.handlers
+import atexit
 import time
+import math
 import sqlite3
-import json
-from datetime import datetime
-from threading import Thread
+import orjson
+import uuid
+import queue
+import itertools
+from functools import lru_cache
+from collections import namedtuple
+from datetime import datetime, date
+from decimal import Decimal
+from threading import Thread, Lock, local, current_thread
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 import os
+import fcntl
+import socket
+from urllib.parse import urlsplit
 import mysql.connector
-from mysql.connector import pooling, Error
+from mysql.connector import pooling, Error, HAVE_CEXT
+from mysql.connector.errors import InterfaceError, OperationalError, PoolError
 
 # ========================
 # CONFIGURATION
@@ -34,35 +51,169 @@ class Config:
         'user': 'gateway_user',       # User on Database Pi
         'password': 'gateway_pass',   # Password on Database Pi
         'pool_name': 'gateway_pool',
-        'pool_size': 5,
-        'pool_reset_session': True
+        'pool_size': 12,              # WSGI_THREADS + SENSOR_FLUSH_WORKERS + offline sync + health refresher
+        'pool_reset_session': False,  # Keep prepared statements across pool checkouts
+        'autocommit': True,           # ...so no transaction snapshot outlives a checkout
+        'use_pure': False             # C extension encodes the protocol in C, not Python
     }
     
     # Local offline storage (SQLite on Gateway Pi)
     OFFLINE_STORAGE_PATH = '/home/gateway/soil_gateway_data/offline_queue.db'
+    LOG_FILE = '/home/gateway/soil_gateway_data/gateway.log'
+    SYNC_LOCK_PATH = '/home/gateway/soil_gateway_data/offline_sync.lock'  # Held by the one process running offline sync
     MAX_OFFLINE_RECORDS = 10000
+    OFFLINE_WRITE_QUEUE_SIZE = 5000  # Pending writes buffered in memory
+    OFFLINE_WRITE_BATCH_SIZE = 100   # Rows group-committed per SQLite transaction
+    OFFLINE_WRITE_LINGER = 0.1       # Seconds the writer waits to fill a transaction
+    OFFLINE_TRIM_SLACK = 100         # Overshoot allowed before the queue is trimmed
+    OFFLINE_UPDATE_TIMEOUT = 30      # Seconds offline sync waits for the writer to commit an attempt update
+    SQLITE_BUSY_TIMEOUT = 5.0        # Seconds a connection waits on a locked database
+    SQLITE_PAGE_SIZE = 16384         # Fewer page reads when draining a large backlog
+    SQLITE_VACUUM_MAX_BYTES = 64 * 1024 * 1024  # Larger files keep their page size rather than VACUUM at boot
     
     # Forwarding settings
     API_TIMEOUT = 10  # seconds for API calls
     MAX_RETRIES = 3
     RETRY_DELAY = 5  # seconds
+    POOL_WAIT_TIMEOUT = 2  # seconds to wait for a free pooled MySQL connection
+    WSGI_THREADS = 8  # Request threads for `python gateway.py` under waitress; matches gunicorn_conf.py
     
     # Health check interval (seconds)
-    HEALTH_CHECK_INTERVAL = 300  # 5 minutes
+    API_BREAKER_THRESHOLD = 3  # Consecutive failed API calls before calls are short-circuited
+    API_BREAKER_MAX_OPEN = 300  # Longest backoff (seconds) while the API keeps failing
+    MYSQL_SYNC_COOLOFF = 30  # Seconds offline sync leaves MySQL alone after a connection failure
+    HEALTH_CHECK_INTERVAL = 30  # Background re-probe period for cached health
+    API_HEALTH_PROBE_TIMEOUT = 2  # seconds for the background TCP probe of the API
+    OFFLINE_COUNTS_TTL = 10  # Max age (seconds) of the offline queue counts shown by /api/health
+    
+    # Sensor assignment cache (seconds)
+    ASSIGNMENT_CACHE_TTL = 300  # 5 minutes
+    ASSIGNMENT_CACHE_SIZE = 2048  # Sensors kept in the assignment cache
+    UNKNOWN_SENSOR_CACHE_TTL = 60  # Unknown or unassigned sensors, so a new assignment shows up within 1 minute
     
     # Batch processing
+    API_SYNC_WORKERS = 8  # Offline API records replayed concurrently
+    SENSOR_BATCH_LINGER = 0.2  # Seconds the MySQL flusher waits to fill a batch
     BATCH_SIZE = 50
     BATCH_INTERVAL = 60  # Process offline data every 60 seconds
+    SENSOR_QUEUE_SIZE = 10000  # Readings buffered in memory ahead of MySQL (split across flushers)
+    SENSOR_FLUSH_WORKERS = 2  # Parallel MySQL flushers, each with its own shard of the ingest queue
+    OVERLOAD_RETRY_AFTER = 5  # Retry-After (seconds) sent with 429 when the gateway's queues are full
 
 # ========================
 # DATABASE MANAGER
 # ========================
+# SQL kept at module level so every call passes the same string object to the driver
+SQL_SELECT_ASSIGNMENT = """
+    SELECT 
+        s.machine_id,
+        s.farm_id,
+        s.zone_code,
+        s.installation,
+        f.farm_name,
+        c.client_name,
+        c.client_id
+    FROM sensors s
+    LEFT JOIN farms f ON s.farm_id = f.farm_id
+    LEFT JOIN client c ON f.client_id = c.client_id
+"""
+SQL_GET_ASSIGNMENT = SQL_SELECT_ASSIGNMENT + "    WHERE s.machine_id = %s\n"
+SQL_GET_ASSIGNMENTS_IN = SQL_SELECT_ASSIGNMENT + "    WHERE s.machine_id IN ({placeholders})\n"
+
+SQL_INSERT_SENSOR_HEAD = """
+    INSERT INTO sensor_data 
+    (farm_id, zone_code, machine_id, timestamp, moisture, temperature, 
+     conductivity, ph, nitrogen, phosphorus, potassium) 
+    VALUES """
+SQL_SENSOR_VALUES_ROW = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+SQL_INSERT_SENSOR = SQL_INSERT_SENSOR_HEAD + SQL_SENSOR_VALUES_ROW + "\n"
+
+# Batch sizes repeat (at most BATCH_SIZE), so each variable-length statement is built once
+@lru_cache(maxsize=64)
+def _sql_insert_sensor_rows(count):
+    """Multi-row SQL_INSERT_SENSOR with count VALUES tuples"""
+    return SQL_INSERT_SENSOR_HEAD + ", ".join([SQL_SENSOR_VALUES_ROW] * count) + "\n"
+
+@lru_cache(maxsize=64)
+def _sql_get_assignments_in(count):
+    """SQL_GET_ASSIGNMENTS_IN with count placeholders"""
+    return SQL_GET_ASSIGNMENTS_IN.format(placeholders=', '.join(['%s'] * count))
+
+# Reading columns of SQL_INSERT_SENSOR, after farm_id, zone_code, machine_id, timestamp
+SENSOR_READING_KEYS = ('moisture', 'temperature', 'conductivity', 'ph', 'nitrogen', 'phosphorus', 'potassium')
+
+# Timestamp layouts MySQL DATETIME accepts as-is (no time zone suffix or offset)
+SENSOR_TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+
+def validate_reading(data):
+    """Return an error message for a malformed sensor reading, or None if it can be inserted
+    
+    Catching bad values here keeps one malformed reading from failing a whole
+    MySQL batch (and then failing again on every offline retry). Numeric
+    strings such as "23.5" are still accepted and converted to floats in place.
+    """
+    machine_id = data.get('machine_id')
+    if not machine_id:
+        return "Missing machine_id"
+    if type(machine_id) is not str and type(machine_id) is not int:
+        return "machine_id must be a string or integer"
+    
+    timestamp = data.get('timestamp')
+    if timestamp:  # Missing or empty means "now"
+        if not isinstance(timestamp, str) or not any(_parses(timestamp, fmt) for fmt in SENSOR_TIMESTAMP_FORMATS):
+            return "timestamp must be 'YYYY-MM-DD HH:MM:SS[.ffffff]' (or with a 'T' separator)"
+    
+    for key in SENSOR_READING_KEYS:
+        value = data.get(key)
+        if value is None or isinstance(value, (int, float)):
+            continue
+        try:
+            number = float(value) if isinstance(value, str) else None
+        except ValueError:
+            number = None
+        if number is None or not math.isfinite(number):
+            return f"{key} must be a number"
+        data[key] = number
+    return None
+
+def _parses(timestamp, fmt):
+    try:
+        datetime.strptime(timestamp, fmt)
+        return True
+    except ValueError:
+        return False
+
+def _sensor_row(assignment_info, data, default_timestamp):
+    """Build the SQL_INSERT_SENSOR parameters for one reading (missing readings default to 0)"""
+    get = data.get
+    return (
+        assignment_info['farm_id'],
+        assignment_info['zone_code'],
+        data['machine_id'],
+        get('timestamp') or default_timestamp,
+        *[get(key, 0) for key in SENSOR_READING_KEYS]
+    )
+
+def _assignment_ttl(assignment_info):
+    """Seconds an assignment lookup stays cached; unknown and unassigned sensors expire sooner"""
+    if assignment_info is None or (isinstance(assignment_info, dict) and assignment_info.get('assigned') is False):
+        return Config.UNKNOWN_SENSOR_CACHE_TTL
+    return Config.ASSIGNMENT_CACHE_TTL
+
 class DatabaseManager:
     _connection_pool = None
+    _pool_lock = Lock()
+    _assignment_cache = {}  # machine_id -> (assignment_info or None if unknown, cached_at)
+    _assignment_lock = Lock()
     
     @classmethod
     def initialize_pool(cls):
         """Initialize MySQL connection pool to Database Pi"""
+        # Fall back to the pure-Python protocol if the C extension can't be loaded
+        use_pure = Config.DB_CONFIG['use_pure'] or not HAVE_CEXT
+        if use_pure and not Config.DB_CONFIG['use_pure']:
+            logging.warning("⚠️ mysql-connector C extension not available, using pure-Python driver")
+        
         try:
             cls._connection_pool = pooling.MySQLConnectionPool(
                 pool_name=Config.DB_CONFIG['pool_name'],
@@ -72,11 +223,13 @@ class DatabaseManager:
                 port=Config.DB_CONFIG['port'],
                 database=Config.DB_CONFIG['database'],
                 user=Config.DB_CONFIG['user'],
-                password=Config.DB_CONFIG['password']
+                password=Config.DB_CONFIG['password'],
+                autocommit=Config.DB_CONFIG['autocommit'],
+                use_pure=use_pure
             )
             
             # Test connection to Database Pi
-            conn = cls.get_connection()
+            conn = cls._connection_pool.get_connection()
             if conn.is_connected():
                 logging.info(f"✅ MySQL connection to {Config.DB_CONFIG['host']} initialized successfully")
                 conn.close()
@@ -92,60 +245,131 @@ class DatabaseManager:
     
     @classmethod
     def get_connection(cls):
-        """Get connection from pool to Database Pi"""
-        if not cls._connection_pool:
-            if not cls.initialize_pool():
-                raise Exception(f"Database connection pool to {Config.DB_CONFIG['host']} not available")
+        """Get a live connection from pool to Database Pi
         
+        Idle pooled connections can be dropped server-side by wait_timeout, so
+        each one is pinged (and reconnected if needed) before it is handed out.
+        An exhausted pool is retried for up to POOL_WAIT_TIMEOUT seconds.
+        """
+        if cls._connection_pool is None:
+            with cls._pool_lock:
+                if cls._connection_pool is None and not cls.initialize_pool():
+                    raise InterfaceError(f"Database connection pool to {Config.DB_CONFIG['host']} not available")
+        
+        for attempt in range(2):
+            try:
+                conn = cls._get_pooled_connection()
+            except Error as e:
+                logging.error(f"❌ Failed to get database connection to {Config.DB_CONFIG['host']}: {e}")
+                raise
+            
+            try:
+                conn.ping(reconnect=True, attempts=1, delay=0)
+                return conn
+            except Error as e:
+                conn.close()
+                if attempt:
+                    logging.error(f"❌ Database connection to {Config.DB_CONFIG['host']} is not responding: {e}")
+                    raise
+    
+    @classmethod
+    def _get_pooled_connection(cls):
+        """Check out a pooled connection, waiting briefly if every one is in use"""
+        deadline = time.monotonic() + Config.POOL_WAIT_TIMEOUT
+        delay = 0.01
+        while True:
+            try:
+                return cls._connection_pool.get_connection()
+            except PoolError:
+                # mysql-connector raises at once when the pool is empty instead of blocking
+                if time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.2)
+    
+    @classmethod
+    def _prepared_insert_cursor(cls, conn):
+        """Get the prepared sensor_data INSERT cursor for this connection, preparing it once
+        
+        The cursor lives on the underlying connection object (pooled connections
+        wrap it), tagged with the server connection_id it was prepared on. After
+        a reconnect the id changes and the cursor is closed and re-prepared.
+        Only the thread holding the connection touches it, so no lock is needed.
+        """
+        raw_conn = getattr(conn, '_cnx', conn)
+        connection_id, cursor = getattr(raw_conn, '_gateway_insert_cursor', (None, None))
+        if cursor is None or connection_id != conn.connection_id:
+            cls._discard_prepared_cursor(conn)
+            cursor = conn.cursor(prepared=True)
+            raw_conn._gateway_insert_cursor = (conn.connection_id, cursor)
+        return cursor
+    
+    @classmethod
+    def _discard_prepared_cursor(cls, conn):
+        """Close and forget a prepared cursor whose statement may no longer be valid"""
+        raw_conn = getattr(conn, '_cnx', conn)
+        _, cursor = getattr(raw_conn, '_gateway_insert_cursor', (None, None))
+        if cursor is None:
+            return
+        raw_conn._gateway_insert_cursor = (None, None)
         try:
-            return cls._connection_pool.get_connection()
-        except Error as e:
-            logging.error(f"❌ Failed to get database connection to {Config.DB_CONFIG['host']}: {e}")
-            raise
+            cursor.close()
+        except Exception:
+            pass  # The session it was prepared on may already be gone
+    
+    @classmethod
+    def invalidate_assignment(cls, machine_id):
+        """Drop cached assignment info so the next lookup hits Database Pi"""
+        with cls._assignment_lock:
+            cls._assignment_cache.pop(machine_id, None)
+    
+    @staticmethod
+    def _is_fresh(entry, now):
+        """Check a cache entry; unknown and unassigned sensors expire sooner than real assignments"""
+        if entry is None:
+            return False
+        return now - entry[1] < _assignment_ttl(entry[0])
+    
+    @classmethod
+    def _cache_put(cls, machine_id, assignment_info):
+        """Cache assignment info (None for a sensor Database Pi doesn't know)"""
+        with cls._assignment_lock:
+            # Re-insert so dict order is refresh order; evict the stalest entries past the bound
+            cls._assignment_cache.pop(machine_id, None)
+            cls._assignment_cache[machine_id] = (assignment_info, time.monotonic())
+            while len(cls._assignment_cache) > Config.ASSIGNMENT_CACHE_SIZE:
+                del cls._assignment_cache[next(iter(cls._assignment_cache))]
     
     @classmethod
     def get_sensor_assignment(cls, machine_id):
-        """Get sensor assignment info from Database Pi"""
-        query = """
-            SELECT 
-                s.machine_id,
-                s.farm_id,
-                s.zone_code,
-                s.installation,
-                f.farm_name,
-                c.client_name,
-                c.client_id
-            FROM sensors s
-            LEFT JOIN farms f ON s.farm_id = f.farm_id
-            LEFT JOIN client c ON f.client_id = c.client_id
-            WHERE s.machine_id = %s
+        """Get sensor assignment info from Database Pi (cached for ASSIGNMENT_CACHE_TTL)
+        
+        Returns None only for a sensor Database Pi doesn't know; database
+        errors are raised so callers don't mistake an outage for a missing sensor.
         """
+        with cls._assignment_lock:
+            entry = cls._assignment_cache.get(machine_id)
+        if cls._is_fresh(entry, time.monotonic()):
+            return entry[0]
         
         conn = None
         cursor = None
         try:
             conn = cls.get_connection()
             cursor = conn.cursor(dictionary=True)
-            cursor.execute(query, (machine_id,))
+            cursor.execute(SQL_GET_ASSIGNMENT, (machine_id,))
             result = cursor.fetchone()
             
             if not result:
+                # Negative-cache so a misconfigured sensor doesn't cost a JOIN per reading
+                cls._cache_put(machine_id, None)
                 return None
             
-            return {
-                'machine_id': machine_id,
-                'assigned': result['farm_id'] is not None,
-                'farm_id': result['farm_id'],
-                'zone_code': result['zone_code'],
-                'installation_date': result['installation'],
-                'farm_name': result['farm_name'],
-                'client_id': result['client_id'],
-                'client_name': result['client_name']
-            }
+            return cls._cache_assignment(machine_id, result)
             
         except Error as e:
             logging.error(f"Database error getting sensor assignment from {Config.DB_CONFIG['host']}: {e}")
-            return None
+            raise
         finally:
             if cursor:
                 cursor.close()
@@ -153,50 +377,120 @@ class DatabaseManager:
                 conn.close()
     
     @classmethod
-    def insert_sensor_data(cls, data):
-        """Insert sensor data directly into Database Pi"""
-        query = """
-            INSERT INTO sensor_data 
-            (farm_id, zone_code, machine_id, timestamp, moisture, temperature, 
-             conductivity, ph, nitrogen, phosphorus, potassium) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    def _cache_assignment(cls, machine_id, result):
+        """Build assignment info from a sensors/farms/client row and cache it"""
+        assignment_info = {
+            'machine_id': machine_id,
+            'assigned': result['farm_id'] is not None,
+            'farm_id': result['farm_id'],
+            'zone_code': result['zone_code'],
+            'installation_date': result['installation'],
+            'farm_name': result['farm_name'],
+            'client_id': result['client_id'],
+            'client_name': result['client_name']
+        }
+        
+        cls._cache_put(machine_id, assignment_info)
+        return assignment_info
+    
+    @classmethod
+    def get_assignments_bulk(cls, machine_ids, conn=None):
+        """Get assignment info for many sensors, keyed by machine_id
+        
+        Cached sensors (and recently unknown ones) are served from the cache; the rest are
+        resolved with a single IN query and cached. Pass conn to run the query
+        on a connection the caller already holds (it is left open).
         """
+        assignments = {}
+        missing = []
+        now = time.monotonic()
+        with cls._assignment_lock:
+            for machine_id in dict.fromkeys(machine_ids):
+                entry = cls._assignment_cache.get(machine_id)
+                if not cls._is_fresh(entry, now):
+                    missing.append(machine_id)
+                elif entry[0] is not None:
+                    assignments[machine_id] = entry[0]
         
-        # First, get farm_id and zone_code for this sensor
-        assignment_info = cls.get_sensor_assignment(data['machine_id'])
-        
-        if not assignment_info or not assignment_info['assigned']:
-            raise Exception(f"Sensor {data['machine_id']} is not assigned to any farm/zone")
-        
-        values = (
-            assignment_info['farm_id'],
-            assignment_info['zone_code'],
-            data['machine_id'],
-            data.get('timestamp', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-            data.get('moisture', 0),
-            data.get('temperature', 0),
-            data.get('conductivity', 0),
-            data.get('ph', 0),
-            data.get('nitrogen', 0),
-            data.get('phosphorus', 0),
-            data.get('potassium', 0)
-        )
+        if not missing:
+            return assignments
+        
+        owns_conn = conn is None
+        cursor = None
+        try:
+            if owns_conn:
+                conn = cls.get_connection()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(_sql_get_assignments_in(len(missing)), tuple(missing))
+            
+            for result in cursor.fetchall():
+                assignments[result['machine_id']] = cls._cache_assignment(result['machine_id'], result)
+            
+            for machine_id in missing:
+                if machine_id not in assignments:
+                    cls._cache_put(machine_id, None)
+            
+            return assignments
+            
+        except Error as e:
+            logging.error(f"Database error getting sensor assignments from {Config.DB_CONFIG['host']}: {e}")
+            raise
+        finally:
+            if cursor:
+                cursor.close()
+            if owns_conn and conn:
+                conn.close()
+    
+    @classmethod
+    def insert_sensor_data_batch(cls, rows):
+        """Insert many sensor readings into Database Pi in one transaction
+        
+        Returns (inserted_count, rejected) where rejected lists the indexes of
+        rows whose sensor is not assigned to any farm/zone.
+        """
+        if not rows:
+            return 0, []
         
         conn = None
         cursor = None
         try:
+            # Lookup and insert share one pooled connection
             conn = cls.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, values)
+            
+            # One lookup for every sensor in the batch instead of one per row
+            assignments = cls.get_assignments_bulk((data['machine_id'] for data in rows), conn=conn)
+            
+            values_list = []
+            rejected = []
+            now = datetime.now()  # Default for readings without a timestamp; the driver formats DATETIME
+            for index, data in enumerate(rows):
+                assignment_info = assignments.get(data['machine_id'])
+                if not assignment_info or not assignment_info['assigned']:
+                    rejected.append(index)
+                    continue
+                
+                values_list.append(_sensor_row(assignment_info, data, now))
+            
+            if not values_list:
+                return 0, rejected
+            
+            if len(values_list) == 1:
+                # A lone reading (the usual case between bursts) reuses the connection's prepared INSERT
+                cls._prepared_insert_cursor(conn).execute(SQL_INSERT_SENSOR, values_list[0])
+            else:
+                cursor = conn.cursor()
+                # One multi-row INSERT from a cached statement; executemany would re-parse
+                # SQL_INSERT_SENSOR with regexes on every call to build the same thing
+                cursor.execute(_sql_insert_sensor_rows(len(values_list)), list(itertools.chain.from_iterable(values_list)))
             conn.commit()
             
-            inserted_id = cursor.lastrowid
-            logging.info(f"✅ Sensor data inserted into MySQL at {Config.DB_CONFIG['host']} (ID: {inserted_id})")
-            return inserted_id
+            logging.info("✅ %d sensor readings batch-inserted into MySQL at %s", len(values_list), Config.DB_CONFIG['host'])
+            return len(values_list), rejected
             
         except Error as e:
-            logging.error(f"❌ MySQL insert error at {Config.DB_CONFIG['host']}: {e}")
+            logging.error("❌ MySQL batch insert error at %s: %s", Config.DB_CONFIG['host'], e)
             if conn:
+                cls._discard_prepared_cursor(conn)
                 conn.rollback()
             raise
         finally:
@@ -207,15 +501,14 @@ class DatabaseManager:
     
     @classmethod
     def check_health(cls):
-        """Check Database Pi MySQL health"""
+        """Check Database Pi MySQL health
+        
+        get_connection() already pings the connection it hands out, so a
+        successful checkout is the liveness check - no query needed.
+        """
         try:
-            conn = cls.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1")
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            return result[0] == 1
+            cls.get_connection().close()
+            return True
         except Error as e:
             logging.error(f"MySQL health check failed for {Config.DB_CONFIG['host']}: {e}")
             return False
@@ -223,17 +516,44 @@ class DatabaseManager:
 # ========================
 # APPLICATION SETUP
 # ========================
+def _json_default(obj):
+    """Serialize types orjson passes through, the same way Flask's default provider does"""
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (Decimal, uuid.UUID)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson (sorted keys, HTTP dates like Flask's default)"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=_json_default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Setup logging - request threads only enqueue records; a listener thread does the file/console I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# logrotate (see install.sh) owns rotation; WatchedFileHandler reopens the file once it is moved
+_log_file_handler = logging.handlers.WatchedFileHandler(Config.LOG_FILE, encoding='utf-8', delay=True)
+_log_stream_handler = logging.StreamHandler()
+for _handler in (_log_file_handler, _log_stream_handler):
+    _handler.setFormatter(_log_formatter)
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/home/gateway/soil_gateway_data/gateway.log'),
-        logging.StreamHandler()
-    ]
-)
+_log_queue = queue.SimpleQueue()
+logging.getLogger().setLevel(logging.INFO)
+# QueueHandler merges msg % args on the calling thread; the listener applies _log_formatter and writes
+logging.getLogger().addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_file_handler, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # Flush queued records on exit
 logger = logging.getLogger(__name__)
 
 # Statistics
@@ -251,119 +571,445 @@ gateway_stats = {
     'last_api_check': None,
     'api_available': False
 }
+_stats_lock = Lock()
+
+def bump_stat(key, amount=1):
+    """Increment a gateway_stats counter; += on a shared dict is not atomic across threads"""
+    with _stats_lock:
+        gateway_stats[key] += amount
+
+def drain_batch(source, max_items, linger):
+    """Block for one queued item, then collect up to max_items arriving within linger seconds"""
+    items = [source.get()]
+    deadline = time.monotonic() + linger
+    while len(items) < max_items:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                items.append(source.get(timeout=remaining))
+            else:
+                items.append(source.get_nowait())
+        except queue.Empty:
+            break
+    return items
+
+# Persistent HTTP session to Database Pi API (keep-alive connection pool)
+_api_session = requests.Session()
+_api_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0)
+_api_session.mount('http://', _api_adapter)
+_api_session.mount('https://', _api_adapter)  # Keeps pooling if API_URL moves to TLS
+_api_session.headers.update({'Connection': 'keep-alive'})
+JSON_HEADERS = {'Content-Type': 'application/json'}
 
 # ========================
 # OFFLINE STORAGE (SQLite on Gateway Pi)
 # ========================
+# UPDATE ... RETURNING needs SQLite 3.35+ (Raspberry Pi OS Bullseye ships 3.34)
+HAVE_SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Offline queue destinations (stored as integers)
+DEST_MYSQL = 0
+DEST_API = 1
+DEST_NAMES = {DEST_MYSQL: 'mysql', DEST_API: 'api'}
+
+OFFLINE_QUEUE_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS {{table}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        endpoint TEXT NOT NULL,
+        data BLOB NOT NULL,  -- orjson-encoded payload
+        timestamp INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),  -- UNIX seconds
+        attempts INTEGER DEFAULT 0,
+        last_attempt DATETIME,
+        destination INTEGER NOT NULL CHECK(destination IN ({DEST_MYSQL}, {DEST_API}))
+    )
+'''
+
+# Hot-path statements; conn.execute() with the same string hits sqlite3's statement cache
+SQL_OFFLINE_INSERT = '''
+    INSERT INTO offline_queue (endpoint, data, destination)
+    VALUES (?, ?, ?)
+'''
+
+# The retry limit is a literal so these match the partial index idx_queue_ready.
+# INDEXED BY pins it: without ANALYZE stats the planner picks idx_queue_pending and sorts
+SQL_OFFLINE_PENDING = f'''
+    SELECT id, endpoint, data FROM offline_queue INDEXED BY idx_queue_ready 
+    WHERE destination = ? AND attempts < {Config.MAX_RETRIES}
+    ORDER BY timestamp ASC 
+    LIMIT ?
+'''
+
+SQL_OFFLINE_HAS_PENDING = f'''
+    SELECT 1 FROM offline_queue 
+    WHERE destination = ? AND attempts < {Config.MAX_RETRIES}
+    LIMIT 1
+'''
+
+SQL_OFFLINE_COUNTS = '''
+    SELECT COUNT(*),
+           COALESCE(SUM(destination = ? AND attempts < ?), 0),
+           COALESCE(SUM(destination = ? AND attempts < ?), 0)
+    FROM offline_queue
+'''
+
+SQL_OFFLINE_BUMP_ATTEMPT = '''
+    UPDATE offline_queue 
+    SET attempts = attempts + 1, 
+        last_attempt = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
+# Id lists are bound as one JSON array so each statement has a single SQL text,
+# keeping it in the connection's statement cache whatever the batch size
+SQL_OFFLINE_DELETE_IDS = '''
+    DELETE FROM offline_queue 
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+SQL_OFFLINE_BUMP_ATTEMPTS_RETURNING = '''
+    UPDATE offline_queue 
+    SET attempts = attempts + 1, 
+        last_attempt = CURRENT_TIMESTAMP
+    WHERE id IN (SELECT value FROM json_each(?))
+    RETURNING id, attempts
+'''
+
+SQL_OFFLINE_ATTEMPTS_FOR_IDS = '''
+    SELECT id, attempts FROM offline_queue 
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+# Keeps the newest ? rows as one rowid range delete; ids follow insert order
+SQL_OFFLINE_TRIM = '''
+    DELETE FROM offline_queue 
+    WHERE id <= (
+        SELECT id FROM offline_queue 
+        ORDER BY id DESC 
+        LIMIT 1 OFFSET ?
+    )
+'''
+
+# Queued for the SQLite writer alongside (endpoint, data, destination) insert rows
+AttemptUpdate = namedtuple('AttemptUpdate', ['success_ids', 'failed_ids', 'future'])
+# Queued by close_all(): the writer exits after committing everything ahead of it
+_WRITER_STOP = object()
+
 class OfflineStorage:
+    SCHEMA_VERSION = 3  # Bump when OFFLINE_QUEUE_SCHEMA changes; older files are rebuilt
+    
     def __init__(self, db_path):
         self.db_path = db_path
+        self._local = local()
+        self._connections = {}  # thread -> connection, for close_all()
+        self._connections_lock = Lock()
+        self._write_queue = queue.Queue(maxsize=Config.OFFLINE_WRITE_QUEUE_SIZE)
+        self._ticket_counter = itertools.count(1)
+        self._approx_count = 0  # Row count kept in step with inserts/deletes, avoids COUNT(*) per write
+        self._count_lock = Lock()
+        self._counts_cache = (None, 0.0)  # (queue_counts() result, monotonic time)
+        self._counts_lock = Lock()
         self.init_db()
+        
+        self._writer = Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+    
+    def _connect(self):
+        """Get this thread's persistent SQLite connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
+        # Autocommit mode: transactions are opened explicitly with BEGIN/COMMIT
+        # timeout sets the busy handler (PRAGMA busy_timeout) so writers wait instead of failing
+        conn = sqlite3.connect(self.db_path, timeout=Config.SQLITE_BUSY_TIMEOUT,
+                               check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')  # Address space only, pages shared across connections
+        conn.execute('PRAGMA cache_size=-20000')  # Per connection, so kept modest on the Pi
+        conn.execute('PRAGMA journal_size_limit=16777216')  # Shrink the WAL back after a backlog burst
+        self._local.conn = conn
+        
+        with self._connections_lock:
+            # Close connections left behind by finished request threads
+            for thread in [t for t in self._connections if not t.is_alive()]:
+                self._connections.pop(thread).close()
+            self._connections[current_thread()] = conn
+        
+        return conn
+    
+    def close_all(self):
+        """Stop the writer, write what is still queued and close every thread's SQLite connection (call on shutdown)
+        
+        The writer is joined first, so no connection is closed while it is
+        mid-transaction or holding rows in its linger window.
+        """
+        if self._writer.is_alive():
+            try:
+                self._write_queue.put(_WRITER_STOP, timeout=Config.OFFLINE_UPDATE_TIMEOUT)
+            except queue.Full:
+                pass
+            self._writer.join(timeout=Config.OFFLINE_UPDATE_TIMEOUT)
+            if self._writer.is_alive():
+                logger.warning("SQLite writer did not stop in time, closing its connection anyway")
+        self.flush()
+        with self._connections_lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = local()
     
     def init_db(self):
         """Initialize SQLite database for offline storage on Gateway Pi"""
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS offline_queue (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                endpoint TEXT NOT NULL,
-                data TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                attempts INTEGER DEFAULT 0,
-                last_attempt DATETIME,
-                destination TEXT NOT NULL CHECK(destination IN ('mysql', 'api'))
-            )
+        cursor.execute('PRAGMA page_size')
+        if cursor.fetchone()[0] != Config.SQLITE_PAGE_SIZE:
+            self._set_page_size(cursor)
+        
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'offline_queue'")
+        table_exists = cursor.fetchone() is not None
+        
+        cursor.execute('BEGIN IMMEDIATE')
+        if table_exists and version < self.SCHEMA_VERSION:
+            self._rebuild_queue_table(cursor)
+            logger.info(f"SQLite offline queue migrated from schema v{version} to v{self.SCHEMA_VERSION}")
+        else:
+            cursor.execute(OFFLINE_QUEUE_SCHEMA.format(table='offline_queue'))
+        cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        
+        # Per-destination counts and has_pending probes
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_queue_pending ON offline_queue(destination, attempts, timestamp)')
+        # Retryable records only, already in timestamp order - no sort for the sync batch
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'idx_queue_ready'")
+        row = cursor.fetchone()
+        if row and f'attempts < {Config.MAX_RETRIES}' not in row[0]:
+            cursor.execute('DROP INDEX idx_queue_ready')  # MAX_RETRIES changed
+        cursor.execute(f'''
+            CREATE INDEX IF NOT EXISTS idx_queue_ready ON offline_queue(destination, timestamp)
+            WHERE attempts < {Config.MAX_RETRIES}
         ''')
+        # The trim deletes by rowid range now, so nothing reads this - stop paying for it on insert
+        cursor.execute('DROP INDEX IF EXISTS idx_queue_timestamp')
+        cursor.execute('COMMIT')
+        cursor.execute('ANALYZE')
+        
+        cursor.execute('SELECT COUNT(*) FROM offline_queue')
+        self._approx_count = cursor.fetchone()[0]
+        
+        # WAL turns each commit into one sequential append; the mode persists in the DB file
+        cursor.execute('PRAGMA journal_mode=WAL')
         
-        conn.commit()
-        conn.close()
         logger.info(f"SQLite offline storage initialized: {self.db_path}")
     
+    def _set_page_size(self, cursor):
+        """Switch the database to SQLITE_PAGE_SIZE
+        
+        An empty file just takes the new size. An existing one has to be
+        rewritten with VACUUM, which cannot change page size in WAL mode, so it
+        is briefly switched to a rollback journal (init_db restores WAL).
+        """
+        cursor.execute(f'PRAGMA page_size = {Config.SQLITE_PAGE_SIZE}')
+        
+        file_size = os.path.getsize(self.db_path)
+        if file_size == 0:
+            return
+        if file_size > Config.SQLITE_VACUUM_MAX_BYTES:
+            logger.info(f"SQLite offline queue is {file_size} bytes, keeping its current page size")
+            return
+        
+        cursor.execute('PRAGMA journal_mode=DELETE')
+        cursor.execute('VACUUM')
+        logger.info(f"SQLite offline queue rewritten with {Config.SQLITE_PAGE_SIZE}-byte pages")
+    
+    def _rebuild_queue_table(self, cursor):
+        """Copy offline_queue into the current schema, normalizing older column encodings"""
+        cursor.execute(OFFLINE_QUEUE_SCHEMA.format(table='offline_queue_new'))
+        cursor.execute(f'''
+            INSERT INTO offline_queue_new 
+            (id, endpoint, data, timestamp, attempts, last_attempt, destination)
+            SELECT id, endpoint, CAST(data AS BLOB),
+                   CASE typeof(timestamp)
+                       WHEN 'integer' THEN timestamp
+                       ELSE COALESCE(CAST(strftime('%s', timestamp) AS INTEGER),
+                                     CAST(strftime('%s', 'now') AS INTEGER))
+                   END,
+                   attempts, last_attempt,
+                   CASE destination WHEN 'api' THEN {DEST_API} WHEN {DEST_API} THEN {DEST_API} ELSE {DEST_MYSQL} END
+            FROM offline_queue
+        ''')
+        cursor.execute('DROP TABLE offline_queue')
+        cursor.execute('ALTER TABLE offline_queue_new RENAME TO offline_queue')
+    
     def save_offline(self, endpoint, data, destination):
-        """Save request to offline SQLite queue"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Queue request for the background SQLite writer
         
+        data may be a dict, or bytes that are already JSON-encoded (stored as-is).
+        Returns a queue ticket id, or None when the write queue is full.
+        """
+        payload = data if isinstance(data, bytes) else orjson.dumps(data)
         try:
-            cursor.execute('''
-                INSERT INTO offline_queue (endpoint, data, destination)
-                VALUES (?, ?, ?)
-            ''', (endpoint, json.dumps(data), destination))
+            self._write_queue.put_nowait((endpoint, payload, destination))
+        except queue.Full:
+            logger.error("SQLite write queue full (%d), dropping %s (Dest: %s)", Config.OFFLINE_WRITE_QUEUE_SIZE, endpoint, DEST_NAMES[destination])
+            return None
+        
+        record_id = next(self._ticket_counter)
+        logger.info("Queued for SQLite offline storage: %s (Dest: %s, Ticket: %s)", endpoint, DEST_NAMES[destination], record_id)
+        return record_id
+    
+    def _writer_loop(self):
+        """Drain the write queue, group-committing each batch in one transaction"""
+        while True:
+            items = drain_batch(self._write_queue, Config.OFFLINE_WRITE_BATCH_SIZE, Config.OFFLINE_WRITE_LINGER)
+            writes = [item for item in items if item is not _WRITER_STOP]
+            if writes:
+                self._apply_writes(writes)
+            if len(writes) < len(items):
+                return
+    
+    def _apply_writes(self, items):
+        """Apply queued inserts and attempt updates in one transaction and trim the queue
+        
+        Only the writer thread (or flush() at shutdown) calls this, so SQLite
+        never sees two writers competing for the lock.
+        """
+        rows = [item for item in items if not isinstance(item, AttemptUpdate)]
+        updates = [item for item in items if isinstance(item, AttemptUpdate)]
+        conn = None
+        
+        try:
+            # Inside the try: a connect failure (bad path, disk full) must fail this batch, not kill the writer
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            if rows:
+                cursor.executemany(SQL_OFFLINE_INSERT, rows)
             
-            conn.commit()
-            record_id = cursor.lastrowid
-            
-            # Check queue size
-            cursor.execute('SELECT COUNT(*) FROM offline_queue')
-            count = cursor.fetchone()[0]
-            
-            if count > Config.MAX_OFFLINE_RECORDS:
-                cursor.execute('''
-                    DELETE FROM offline_queue 
-                    WHERE id IN (
-                        SELECT id FROM offline_queue 
-                        ORDER BY timestamp ASC 
-                        LIMIT ?
-                    )
-                ''', (count - Config.MAX_OFFLINE_RECORDS,))
-                conn.commit()
-                logger.warning(f"Offline queue trimmed to {Config.MAX_OFFLINE_RECORDS} records")
-            
-            logger.info(f"Saved to SQLite offline queue: {endpoint} (Dest: {destination}, ID: {record_id})")
-            return record_id
+            deleted = 0
+            for update in updates:
+                deleted += self._apply_attempt_update(cursor, update.success_ids, update.failed_ids)
+            
+            with self._count_lock:
+                needs_trim = self._approx_count + len(rows) - deleted > Config.MAX_OFFLINE_RECORDS + Config.OFFLINE_TRIM_SLACK
+            
+            # Only trim once the estimate crosses the soft limit, then re-count: with several
+            # gunicorn workers each estimate only sees its own process's inserts and deletes
+            recounted = None
+            if needs_trim:
+                trimmed = cursor.execute(SQL_OFFLINE_TRIM, (Config.MAX_OFFLINE_RECORDS,)).rowcount
+                if trimmed:
+                    logger.warning("Offline queue trimmed to %d records", Config.MAX_OFFLINE_RECORDS)
+                recounted = cursor.execute('SELECT COUNT(*) FROM offline_queue').fetchone()[0]
+            
+            cursor.execute('COMMIT')
             
         except Exception as e:
-            logger.error(f"Failed to save to SQLite: {e}")
-            return None
-        finally:
-            conn.close()
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            if rows:
+                logger.error("Failed to save %d records to SQLite: %s", len(rows), e)
+            for update in updates:
+                update.future.set_exception(e)
+            return
+        
+        # Counted only once committed, so a rolled-back batch doesn't inflate the estimate
+        if recounted is not None:
+            with self._count_lock:
+                self._approx_count = recounted
+        else:
+            self._adjust_count(len(rows) - deleted)
+        if rows:
+            logger.info("Saved %d records to SQLite offline queue", len(rows))
+        for update in updates:
+            update.future.set_result(None)
+    
+    def flush(self):
+        """Write any still-queued rows on the calling thread"""
+        items = []
+        while True:
+            try:
+                item = self._write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _WRITER_STOP:
+                items.append(item)
+        if items:
+            self._apply_writes(items)
     
     def get_pending_records(self, destination, limit=50):
-        """Get pending records from SQLite for retry"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        """Get pending (id, endpoint, data) tuples from SQLite for retry"""
+        return self._connect().execute(SQL_OFFLINE_PENDING, (destination, limit)).fetchall()
+    
+    def has_pending(self, destination):
+        """Check whether any record for destination is still awaiting retry"""
+        cursor = self._connect().execute(SQL_OFFLINE_HAS_PENDING, (destination,))
+        return cursor.fetchone() is not None
+    
+    def queue_counts(self, max_age=0):
+        """Get (total, pending MySQL, pending API) record counts in a single scan
         
-        cursor.execute('''
-            SELECT * FROM offline_queue 
-            WHERE attempts < ? AND destination = ?
-            ORDER BY timestamp ASC 
-            LIMIT ?
-        ''', (Config.MAX_RETRIES, destination, limit))
+        A result younger than max_age seconds is reused; concurrent callers
+        share one scan instead of each running their own.
+        """
+        with self._counts_lock:
+            counts, counted_at = self._counts_cache
+            if counts is None or time.monotonic() - counted_at >= max_age:
+                counts = self._connect().execute(
+                    SQL_OFFLINE_COUNTS, (DEST_MYSQL, Config.MAX_RETRIES, DEST_API, Config.MAX_RETRIES)
+                ).fetchone()
+                self._counts_cache = (counts, time.monotonic())
+            return counts
+    
+    def update_attempts_bulk(self, success_ids, failed_ids):
+        """Delete synced records and bump attempts on failed ones, via the writer thread
         
-        records = cursor.fetchall()
-        conn.close()
+        Blocks until the change is committed, so the next get_pending_records()
+        won't hand out the same records again. Raises if the transaction failed,
+        or if the writer hasn't committed it within OFFLINE_UPDATE_TIMEOUT.
+        """
+        if not success_ids and not failed_ids:
+            return
         
-        return records
+        future = Future()
+        try:
+            self._write_queue.put(AttemptUpdate(success_ids, failed_ids, future), timeout=Config.OFFLINE_UPDATE_TIMEOUT)
+            future.result(timeout=Config.OFFLINE_UPDATE_TIMEOUT)
+        except (queue.Full, FutureTimeout):
+            raise TimeoutError(f"SQLite writer did not commit the attempt update within {Config.OFFLINE_UPDATE_TIMEOUT}s")
     
-    def update_attempt(self, record_id, success):
-        """Update SQLite record after attempt"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _apply_attempt_update(self, cursor, success_ids, failed_ids):
+        """Run one attempt update inside the writer's transaction; returns rows deleted"""
+        deleted = 0
+        if success_ids:
+            cursor.execute(SQL_OFFLINE_DELETE_IDS, (orjson.dumps(success_ids),))
+            deleted = cursor.rowcount
+            logger.info("Removed %d synced records from SQLite", len(success_ids))
         
-        if success:
-            cursor.execute('DELETE FROM offline_queue WHERE id = ?', (record_id,))
-            logger.info(f"Removed synced record from SQLite: {record_id}")
-        else:
-            cursor.execute('''
-                UPDATE offline_queue 
-                SET attempts = attempts + 1, 
-                    last_attempt = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (record_id,))
-            
-            cursor.execute('SELECT attempts FROM offline_queue WHERE id = ?', (record_id,))
-            attempts = cursor.fetchone()[0]
+        if failed_ids:
+            if HAVE_SQLITE_RETURNING:
+                # Bump and read back the new counts in one statement
+                cursor.execute(SQL_OFFLINE_BUMP_ATTEMPTS_RETURNING, (orjson.dumps(failed_ids),))
+            else:
+                cursor.executemany(SQL_OFFLINE_BUMP_ATTEMPT, [(record_id,) for record_id in failed_ids])
+                cursor.execute(SQL_OFFLINE_ATTEMPTS_FOR_IDS, (orjson.dumps(failed_ids),))
             
-            if attempts >= Config.MAX_RETRIES:
-                logger.warning(f"SQLite record {record_id} exceeded max retries, keeping for manual review")
+            for record_id, attempts in cursor.fetchall():
+                if attempts >= Config.MAX_RETRIES:
+                    logger.warning("SQLite record %s exceeded max retries, keeping for manual review", record_id)
         
-        conn.commit()
-        conn.close()
+        return deleted
+    
+    def _adjust_count(self, delta):
+        """Keep the row count estimate in step with committed inserts and deletes"""
+        if delta:
+            with self._count_lock:
+                self._approx_count = max(0, self._approx_count + delta)
 
 # Initialize components
 offline_storage = OfflineStorage(Config.OFFLINE_STORAGE_PATH)
@@ -371,8 +1017,39 @@ offline_storage = OfflineStorage(Config.OFFLINE_STORAGE_PATH)
 # ========================
 # HEALTH CHECKS
 # ========================
-def check_mysql_health():
-    """Check if Database Pi (192.168.1.100) is reachable"""
+# Last probe result per target, kept current by refresh_health_status
+_last_health_result = {'mysql': False, 'api': False}
+
+def _cached_health(name, probe, force=False):
+    """Return the last probe result; only force probes on the calling thread
+    
+    Never probing inline otherwise means an endpoint can't end up waiting on a
+    connect to a dead host (MySQL's even queues behind the pool lock).
+    """
+    if force:
+        _last_health_result[name] = probe()
+    return _last_health_result[name]
+
+def check_mysql_health(force=False):
+    """Check if Database Pi (192.168.1.100) is reachable (cached)"""
+    return _cached_health('mysql', _probe_mysql_health, force)
+
+def check_api_health(force=False):
+    """Check if Database Pi API (192.168.1.95) is reachable (cached; force does a full GET)"""
+    return _cached_health('api', _probe_api_health, force)
+
+def refresh_health_status():
+    """Re-probe both targets in the background so endpoints never wait on a probe
+    
+    The API is only TCP-probed here; call_api results and ?force=1 cover the rest.
+    """
+    while True:
+        check_mysql_health(force=True)
+        _cached_health('api', _probe_api_port, force=True)
+        time.sleep(Config.HEALTH_CHECK_INTERVAL)
+
+def _probe_mysql_health():
+    """Probe Database Pi MySQL"""
     try:
         gateway_stats['mysql_available'] = DatabaseManager.check_health()
         gateway_stats['last_mysql_check'] = datetime.now()
@@ -390,10 +1067,26 @@ def check_mysql_health():
         logger.warning(f"Database Pi MySQL ({Config.DB_CONFIG['host']}) not reachable: {e}")
         return False
 
-def check_api_health():
-    """Check if Database Pi API (192.168.1.95) is reachable"""
+# Database Pi API (host, port), parsed once for the TCP probe
+_api_url = urlsplit(Config.DATABASE_PI_API_URL)
+_api_address = (_api_url.hostname, _api_url.port or (443 if _api_url.scheme == 'https' else 80))
+
+def _probe_api_port():
+    """Probe Database Pi API with a bare TCP connect - no request, no response parsing"""
     try:
-        response = requests.get(
+        with socket.create_connection(_api_address, timeout=Config.API_HEALTH_PROBE_TIMEOUT):
+            gateway_stats['api_available'] = True
+    except OSError as e:
+        gateway_stats['api_available'] = False
+        logger.warning(f"Database Pi API ({Config.DATABASE_PI_API_URL}) not reachable: {e}")
+    
+    gateway_stats['last_api_check'] = datetime.now()
+    return gateway_stats['api_available']
+
+def _probe_api_health():
+    """Probe Database Pi API"""
+    try:
+        response = _api_session.get(
             f"{Config.DATABASE_PI_API_URL}/api/test",
             timeout=5
         )
@@ -416,114 +1109,321 @@ def check_api_health():
 # ========================
 # REQUEST PROCESSING
 # ========================
+# Circuit breaker for Database Pi API: opened by real call failures, not by polling
+_api_breaker = {'failures': 0, 'open_until': 0.0}
+_api_breaker_lock = Lock()
+
+def api_breaker_open():
+    """True while API calls should fail fast instead of waiting on Database Pi"""
+    return time.monotonic() < _api_breaker['open_until']
+
+def _record_api_result(success):
+    """Close the breaker on success; open it with exponential backoff after repeated failures"""
+    with _api_breaker_lock:
+        if success:
+            _api_breaker['failures'] = 0
+            _api_breaker['open_until'] = 0.0
+            return
+        
+        _api_breaker['failures'] += 1
+        failures = _api_breaker['failures']
+        if failures >= Config.API_BREAKER_THRESHOLD:
+            backoff = min(Config.API_BREAKER_MAX_OPEN, 2 ** failures)
+            _api_breaker['open_until'] = time.monotonic() + backoff
+            gateway_stats['api_available'] = False
+            logger.warning(f"API {Config.DATABASE_PI_API_URL} failed {failures} times in a row, pausing calls for {backoff}s")
+
 def call_api(endpoint, data, method='POST'):
-    """Call Database Pi API (192.168.1.95)"""
+    """Call Database Pi API (192.168.1.95)
+    
+    data may be a dict, or bytes that are already JSON-encoded (sent as-is).
+    Fails fast while the API circuit breaker is open. Only connection errors,
+    timeouts and 5xx responses are retried and count toward the breaker.
+    """
+    if api_breaker_open():
+        bump_stat('api_errors')
+        return False, None
+    
     url = f"{Config.DATABASE_PI_API_URL}{endpoint}"
     
     for attempt in range(Config.MAX_RETRIES):
         try:
-            if method == 'POST':
-                response = requests.post(url, json=data, timeout=Config.API_TIMEOUT)
+            if method == 'POST' and isinstance(data, bytes):
+                response = _api_session.post(url, data=data, headers=JSON_HEADERS, timeout=Config.API_TIMEOUT)
+            elif method == 'POST':
+                response = _api_session.post(url, json=data, timeout=Config.API_TIMEOUT)
             else:  # GET
-                response = requests.get(url, timeout=Config.API_TIMEOUT)
+                response = _api_session.get(url, timeout=Config.API_TIMEOUT)
             
-            logger.debug(f"API {endpoint} to {Config.DATABASE_PI_API_URL}: Status {response.status_code}")
+            logger.debug("API %s to %s: Status %s", endpoint, Config.DATABASE_PI_API_URL, response.status_code)
             
             if response.status_code in [200, 201]:
-                gateway_stats['api_calls'] += 1
-                return True, response.json()
+                bump_stat('api_calls')
+                _record_api_result(True)
+                return True, orjson.loads(response.content)  # requests would decode with stdlib json
+            elif response.status_code < 500:
+                # The API is up and rejected this request - retrying won't help, and it
+                # must not count toward the breaker (unregistered sensors get 404s)
+                logger.warning("API %s to %s rejected: Status %s", endpoint, Config.DATABASE_PI_API_URL, response.status_code)
+                bump_stat('api_errors')
+                _record_api_result(True)
+                return False, None
             else:
-                logger.warning(f"API {endpoint} to {Config.DATABASE_PI_API_URL} failed: Status {response.status_code}")
-                time.sleep(Config.RETRY_DELAY)
+                logger.warning("API %s to %s failed: Status %s", endpoint, Config.DATABASE_PI_API_URL, response.status_code)
+                if attempt < Config.MAX_RETRIES - 1:
+                    time.sleep(Config.RETRY_DELAY)
                 
         except Exception as e:
-            logger.warning(f"API attempt {attempt + 1} to {Config.DATABASE_PI_API_URL} failed: {e}")
+            logger.warning("API attempt %d to %s failed: %s", attempt + 1, Config.DATABASE_PI_API_URL, e)
             if attempt < Config.MAX_RETRIES - 1:
                 time.sleep(Config.RETRY_DELAY)
     
-    gateway_stats['api_errors'] += 1
+    bump_stat('api_errors')
+    _record_api_result(False)
     return False, None
 
-def process_sensor_data(data):
-    """Process sensor data - try Database Pi MySQL first, fallback to SQLite"""
+# Last Database Pi API answer per sensor for /assignment: machine_id -> (response, fetched_at)
+_assignment_responses = {}
+_assignment_responses_lock = Lock()
+
+def get_cached_assignment_response(machine_id, max_age):
+    """Get the cached API assignment response if younger than max_age seconds
+    
+    An unassigned answer is never served past UNKNOWN_SENSOR_CACHE_TTL, so a
+    sensor assigned on Database Pi stops reporting unassigned soon after.
+    """
+    with _assignment_responses_lock:
+        entry = _assignment_responses.get(machine_id)
+    if entry and time.monotonic() - entry[1] < min(max_age, _assignment_ttl(entry[0])):
+        return entry[0]
+    return None
+
+def cache_assignment_response(machine_id, response):
+    """Remember an API assignment response (bounded like the MySQL assignment cache)"""
+    with _assignment_responses_lock:
+        _assignment_responses.pop(machine_id, None)
+        _assignment_responses[machine_id] = (response, time.monotonic())
+        while len(_assignment_responses) > Config.ASSIGNMENT_CACHE_SIZE:
+            del _assignment_responses[next(iter(_assignment_responses))]
+
+def invalidate_sensor_assignment(machine_id):
+    """Forget everything cached about a sensor's assignment (after registration)"""
+    DatabaseManager.invalidate_assignment(machine_id)
+    with _assignment_responses_lock:
+        _assignment_responses.pop(machine_id, None)
+
+# Sensor readings waiting for the background MySQL flushers, as (data, future) pairs
+# One queue per flusher, sharded by machine_id so each sensor's readings stay in order
+sensor_ingest_queues = [
+    queue.Queue(maxsize=Config.SENSOR_QUEUE_SIZE // Config.SENSOR_FLUSH_WORKERS)
+    for _ in range(Config.SENSOR_FLUSH_WORKERS)
+]
+
+def ingest_queue_depth():
+    """Readings currently waiting across all flusher queues"""
+    return sum(shard.qsize() for shard in sensor_ingest_queues)
+
+# Outcomes reported to callers waiting on a queued reading
+STORED_MYSQL = 'stored'
+STORED_OFFLINE = 'stored_offline'
+DROPPED = 'dropped'
+
+def process_sensor_data(data, future=None):
+    """Queue sensor data for batched insert into Database Pi MySQL
+    
+    If future is given, it receives STORED_MYSQL, STORED_OFFLINE or DROPPED
+    once the flusher has handled the reading.
+    """
+    shard = sensor_ingest_queues[hash(data['machine_id']) % len(sensor_ingest_queues)]
     try:
-        # Try direct MySQL insert to Database Pi
-        inserted_id = DatabaseManager.insert_sensor_data(data)
-        gateway_stats['mysql_inserts'] += 1
-        return True, {'mysql_id': inserted_id, 'host': Config.DB_CONFIG['host']}
-        
+        shard.put_nowait((data, future))
+        return True, {'queue_depth': ingest_queue_depth()}
+    except queue.Full:
+        return False, {'error': 'Sensor ingest queue full'}
+
+def _resolve(future, outcome):
+    # A reading can be resolved twice if the batch fails after some were already reported
+    if future is not None and not future.done():
+        future.set_result(outcome)
+
+def store_sensor_rows_offline(items):
+    """Save (data, future) sensor readings to SQLite offline storage for later sync"""
+    for data, future in items:
+        if offline_storage.save_offline('/api/sensor-data', data, DEST_MYSQL):
+            bump_stat('stored_offline')
+            _resolve(future, STORED_OFFLINE)
+        else:
+            _resolve(future, DROPPED)
+
+# Failures that say the Database Pi is unreachable, not that a row is bad
+MYSQL_CONNECTION_ERRORS = (InterfaceError, OperationalError, PoolError)
+
+def insert_sensor_rows_isolating(rows):
+    """Batch-insert readings, bisecting a failed batch so only the bad rows fail
+    
+    Returns (inserted_count, rejected, failed): rejected lists indexes of
+    unassigned sensors, failed the indexes of rows MySQL refused. Connection
+    errors are raised, since they say nothing about the rows.
+    """
+    try:
+        inserted, rejected = DatabaseManager.insert_sensor_data_batch(rows)
+        return inserted, rejected, []
+    except MYSQL_CONNECTION_ERRORS:
+        raise
     except Exception as e:
-        logger.warning(f"MySQL insert to {Config.DB_CONFIG['host']} failed, saving to SQLite: {e}")
-        gateway_stats['mysql_errors'] += 1
-        
-        # Save to SQLite offline storage on Gateway Pi
-        record_id = offline_storage.save_offline('/api/sensor-data', data, 'mysql')
-        if record_id:
-            gateway_stats['stored_offline'] += 1
-            return False, {'offline_id': record_id, 'message': f'Data saved to SQLite, will sync to {Config.DB_CONFIG["host"]}'}
-        
-        return False, {'error': 'Failed to save data to SQLite'}
+        if len(rows) == 1:
+            logger.warning(f"MySQL refused reading from sensor {rows[0].get('machine_id')}: {e}")
+            return 0, [], [0]
+    
+    # Each half is its own transaction; the failed batch was rolled back as a whole
+    middle = len(rows) // 2
+    inserted, rejected, failed = 0, [], []
+    for offset, part in ((0, rows[:middle]), (middle, rows[middle:])):
+        part_inserted, part_rejected, part_failed = insert_sensor_rows_isolating(part)
+        inserted += part_inserted
+        rejected.extend(offset + index for index in part_rejected)
+        failed.extend(offset + index for index in part_failed)
+    return inserted, rejected, failed
+
+def flush_sensor_queue(source):
+    """Batch-insert readings from one ingest queue shard into Database Pi, falling back to SQLite
+    
+    After the first reading arrives, waits up to SENSOR_BATCH_LINGER for more
+    so a burst of sensor POSTs becomes one multi-row INSERT and one commit.
+    """
+    while True:
+        items = drain_batch(source, Config.BATCH_SIZE, Config.SENSOR_BATCH_LINGER)
+        rows = [data for data, _ in items]
+        try:
+            inserted, rejected, failed = insert_sensor_rows_isolating(rows)
+            bump_stat('mysql_inserts', inserted)
+            
+            if rejected:
+                logger.warning("%d readings from unassigned sensors, saving to SQLite", len(rejected))
+            if failed:
+                logger.warning("%d readings refused by MySQL, saving to SQLite", len(failed))
+            
+            # Only the unassigned or refused readings go offline, not the whole batch
+            not_stored = set(rejected) | set(failed)
+            if not_stored:
+                bump_stat('mysql_errors', len(not_stored))
+                store_sensor_rows_offline([items[index] for index in sorted(not_stored)])
+            
+            for index, (_, future) in enumerate(items):
+                if index not in not_stored:
+                    _resolve(future, STORED_MYSQL)
+                
+        except Exception as e:
+            logger.warning("MySQL batch insert to %s failed, saving %d readings to SQLite: %s", Config.DB_CONFIG['host'], len(rows), e)
+            bump_stat('mysql_errors', len(rows))
+            store_sensor_rows_offline(items)
+
+# Worker threads for replaying offline API records (requests.Session is thread-safe for this use)
+_api_sync_executor = ThreadPoolExecutor(max_workers=Config.API_SYNC_WORKERS, thread_name_prefix='api-sync')
 
 def process_offline_queue():
-    """Process SQLite offline queue in background - sync to Database Pi"""
+    """Process SQLite offline queue in background - sync to Database Pi
+    
+    Sleeps BATCH_INTERVAL between cycles, except while draining a backlog:
+    a full batch that made progress is followed straight away by the next.
+    """
+    mysql_skip_until = 0.0  # Set after a connection failure instead of probing before each batch
+    backlog = False
+    
     while True:
         try:
-            time.sleep(Config.BATCH_INTERVAL)
+            if not backlog:
+                time.sleep(Config.BATCH_INTERVAL)
+            backlog = False
+            
+            # Idle cycles cost one index probe per destination, no network round-trips
+            pending_mysql = offline_storage.has_pending(DEST_MYSQL)
+            pending_api = offline_storage.has_pending(DEST_API)
+            if not pending_mysql and not pending_api:
+                continue
             
             # Process MySQL-bound records (sync to Database Pi)
-            if check_mysql_health():
-                mysql_records = offline_storage.get_pending_records('mysql', Config.BATCH_SIZE)
+            if pending_mysql and time.monotonic() >= mysql_skip_until:
+                mysql_records = offline_storage.get_pending_records(DEST_MYSQL, Config.BATCH_SIZE)
                 if mysql_records:
-                    logger.info(f"Processing {len(mysql_records)} SQLite records to sync with {Config.DB_CONFIG['host']}")
+                    logger.info("Processing %d SQLite records to sync with %s", len(mysql_records), Config.DB_CONFIG['host'])
                     
-                    for record in mysql_records:
-                        record_id = record['id']
-                        data = json.loads(record['data'])
+                    ids = [record_id for record_id, _, _ in mysql_records]
+                    rows = [orjson.loads(payload) for _, _, payload in mysql_records]
+                    
+                    try:
+                        inserted, rejected, failed = insert_sensor_rows_isolating(rows)
+                    except MYSQL_CONNECTION_ERRORS as e:
+                        # Database Pi unreachable - not the records' fault, leave their attempts alone
+                        mysql_skip_until = time.monotonic() + Config.MYSQL_SYNC_COOLOFF
+                        gateway_stats['mysql_available'] = False
+                        logger.warning("MySQL at %s unavailable, pausing offline sync for %ss: %s", Config.DB_CONFIG['host'], Config.MYSQL_SYNC_COOLOFF, e)
+                    else:
+                        # Outside the try: a SQLite error here must not count against the inserted rows
+                        not_synced = set(rejected) | set(failed)
+                        failed_ids = [ids[index] for index in sorted(not_synced)]
+                        synced_ids = [record_id for index, record_id in enumerate(ids) if index not in not_synced]
+                        
+                        offline_storage.update_attempts_bulk(synced_ids, failed_ids)
+                        bump_stat('offline_synced', inserted)
+                        backlog = backlog or (inserted > 0 and len(mysql_records) == Config.BATCH_SIZE)
+                        logger.info("Synced %d SQLite records to MySQL at %s", inserted, Config.DB_CONFIG['host'])
                         
-                        try:
-                            inserted_id = DatabaseManager.insert_sensor_data(data)
-                            offline_storage.update_attempt(record_id, True)
-                            gateway_stats['offline_synced'] += 1
-                            logger.info(f"Synced SQLite record {record_id} to MySQL at {Config.DB_CONFIG['host']}")
-                        except Exception as e:
-                            offline_storage.update_attempt(record_id, False)
-                            logger.error(f"Failed to sync SQLite record {record_id} to {Config.DB_CONFIG['host']}: {e}")
+                        if rejected:
+                            logger.error("Failed to sync SQLite records %s to %s: sensors not assigned to any farm/zone", [ids[index] for index in rejected], Config.DB_CONFIG['host'])
+                        if failed:
+                            logger.error("Failed to sync SQLite records %s to %s: refused by MySQL", [ids[index] for index in failed], Config.DB_CONFIG['host'])
             
             # Process API-bound records (sync to Database Pi API)
-            if check_api_health():
-                api_records = offline_storage.get_pending_records('api', Config.BATCH_SIZE)
+            if pending_api and not api_breaker_open():
+                api_records = offline_storage.get_pending_records(DEST_API, Config.BATCH_SIZE)
                 if api_records:
-                    logger.info(f"Processing {len(api_records)} SQLite records to sync with {Config.DATABASE_PI_API_URL}")
+                    logger.info("Processing %d SQLite records to sync with %s", len(api_records), Config.DATABASE_PI_API_URL)
                     
-                    for record in api_records:
-                        record_id = record['id']
-                        endpoint = record['endpoint']
-                        data = json.loads(record['data'])
-                        
-                        success, response = call_api(endpoint, data)
-                        offline_storage.update_attempt(record_id, success)
+                    # Replay concurrently so the batch costs about one round-trip, not one per record
+                    # Stored payloads are already JSON, so they are forwarded without decoding
+                    results = _api_sync_executor.map(lambda record: call_api(record[1], record[2]), api_records)
+                    
+                    synced_ids = []
+                    failed_ids = []
+                    for (record_id, endpoint, payload), (success, response) in zip(api_records, results):
+                        (synced_ids if success else failed_ids).append(record_id)
                         
                         if success:
-                            gateway_stats['offline_synced'] += 1
-                            logger.info(f"Synced SQLite record {record_id} to API at {Config.DATABASE_PI_API_URL}")
+                            if endpoint == '/api/sensors/register':
+                                invalidate_sensor_assignment(orjson.loads(payload).get('machine_id'))
+                            bump_stat('offline_synced')
+                            logger.info("Synced SQLite record %s to API at %s", record_id, Config.DATABASE_PI_API_URL)
                         else:
-                            logger.error(f"Failed to sync SQLite API record {record_id} to {Config.DATABASE_PI_API_URL}")
+                            logger.error("Failed to sync SQLite API record %s to %s", record_id, Config.DATABASE_PI_API_URL)
+                    
+                    offline_storage.update_attempts_bulk(synced_ids, failed_ids)
+                    backlog = backlog or (bool(synced_ids) and len(api_records) == Config.BATCH_SIZE)
             
         except Exception as e:
-            logger.error(f"Error processing SQLite offline queue: {e}")
+            logger.error("Error processing SQLite offline queue: %s", e)
             time.sleep(60)
 
 # ========================
 # API ENDPOINTS
 # ========================
+def overloaded_response():
+    """429 with Retry-After, for when the ingest or SQLite write queue is full"""
+    return (
+        jsonify({"error": "Gateway overloaded, retry later"}),
+        429,
+        {"Retry-After": str(Config.OVERLOAD_RETRY_AFTER)}
+    )
+
 @app.route('/api/test', methods=['GET'])
 def test_gateway():
     """Test gateway connectivity"""
     mysql_status = "unknown"
     api_status = "unknown"
     
-    mysql_status = "connected" if check_mysql_health() else "disconnected"
-    api_status = "connected" if check_api_health() else "disconnected"
+    force = request.args.get('force') == '1'
+    mysql_status = "connected" if check_mysql_health(force) else "disconnected"
+    api_status = "connected" if check_api_health(force) else "disconnected"
     
     return jsonify({
         "gateway": "online",
@@ -538,79 +1438,109 @@ def test_gateway():
 
 @app.route('/api/sensor-data', methods=['POST'])
 def handle_sensor_data():
-    """Receive sensor data and store in Database Pi MySQL (or SQLite offline)"""
-    gateway_stats['requests_received'] += 1
+    """Receive sensor data and queue it for Database Pi MySQL (SQLite if MySQL fails)
+    
+    With ?sync=1 the response waits for the batched insert and reports where
+    the reading ended up.
+    """
+    bump_stat('requests_received')
     
     try:
-        data = request.json
-        if not data:
+        # Parse the body directly with orjson - skips Flask's content-type negotiation on the hot path
+        try:
+            data = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            return jsonify({"error": "Invalid JSON"}), 400
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "No data provided"}), 400
         
-        machine_id = data.get('machine_id')
-        if not machine_id:
-            return jsonify({"error": "Missing machine_id"}), 400
+        error = validate_reading(data)
+        if error:
+            return jsonify({"error": error}), 400
+        machine_id = data['machine_id']
         
-        logger.info(f"Received data from sensor {machine_id}")
+        # Hot path: %-style args, so the message is only built when INFO is enabled
+        logger.info("Received data from sensor %s", machine_id)
         
-        # Process data (try Database Pi MySQL first)
-        success, result = process_sensor_data(data)
+        # Queue for the background MySQL flusher - by default the sensor never waits on the database
+        future = Future() if request.args.get('sync') == '1' else None
+        success, result = process_sensor_data(data, future)
         
-        if success:
-            logger.info(f"Data stored in MySQL at {Config.DB_CONFIG['host']} for sensor {machine_id}")
-            return jsonify({
-                "status": "stored",
-                "message": f"Data stored in MySQL database at {Config.DB_CONFIG['host']}",
-                "mysql_id": result.get('mysql_id'),
-                "mysql_host": Config.DB_CONFIG['host'],
-                "timestamp": datetime.now().isoformat()
-            })
-        else:
-            # Data was saved to SQLite offline
-            if 'offline_id' in result:
-                logger.info(f"Data saved to SQLite for sensor {machine_id} (Record: {result['offline_id']})")
+        if success and future is not None:
+            try:
+                outcome = future.result(timeout=Config.API_TIMEOUT)
+            except FutureTimeout:
+                outcome = None  # Still queued; report it as such
+            
+            if outcome == STORED_MYSQL:
+                return jsonify({
+                    "status": "stored",
+                    "message": f"Data stored in MySQL database at {Config.DB_CONFIG['host']}",
+                    "mysql_host": Config.DB_CONFIG['host'],
+                    "timestamp": datetime.now().isoformat()
+                })
+            elif outcome == STORED_OFFLINE:
                 return jsonify({
                     "status": "stored_offline",
                     "message": f"MySQL at {Config.DB_CONFIG['host']} unavailable, data stored in SQLite",
-                    "offline_id": result['offline_id'],
                     "offline_storage": "sqlite",
                     "mysql_host": Config.DB_CONFIG['host'],
                     "timestamp": datetime.now().isoformat()
                 }), 202
-            else:
-                return jsonify({"error": "Failed to store data"}), 500
+            elif outcome == DROPPED:
+                return overloaded_response()
+        
+        if success:
+            return jsonify({
+                "status": "queued",
+                "message": f"Data queued for MySQL database at {Config.DB_CONFIG['host']}",
+                "queue_depth": result['queue_depth'],
+                "mysql_host": Config.DB_CONFIG['host'],
+                "timestamp": datetime.now().isoformat()
+            }), 202
+        else:
+            # Ingest queue is full - tell the sensor to back off
+            logger.warning("Sensor ingest queue full, rejecting data from sensor %s", machine_id)
+            return overloaded_response()
             
     except Exception as e:
-        logger.error(f"Error handling sensor data: {e}")
+        logger.error("Error handling sensor data: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/api/sensors/register', methods=['POST'])
 def handle_sensor_registration():
     """Handle sensor registration via Database Pi API"""
-    gateway_stats['requests_received'] += 1
+    bump_stat('requests_received')
     
     try:
-        data = request.json
-        if not data:
+        # Parsed only to validate; the original bytes are what gets forwarded or queued
+        raw = request.get_data(cache=False)
+        try:
+            data = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            return jsonify({"error": "Invalid JSON"}), 400
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "No data provided"}), 400
         
         machine_id = data.get('machine_id')
         if not machine_id:
             return jsonify({"error": "Missing machine_id"}), 400
         
-        logger.info(f"Registration request for sensor {machine_id}")
+        logger.info("Registration request for sensor %s", machine_id)
         
         # Try to call Database Pi API
-        success, response = call_api('/api/sensors/register', data)
+        success, response = call_api('/api/sensors/register', raw)
         
         if success:
-            logger.info(f"Registration completed for sensor {machine_id} via {Config.DATABASE_PI_API_URL}")
+            invalidate_sensor_assignment(machine_id)
+            logger.info("Registration completed for sensor %s via %s", machine_id, Config.DATABASE_PI_API_URL)
             return jsonify(response), 200
         else:
             # Save to SQLite offline storage
-            record_id = offline_storage.save_offline('/api/sensors/register', data, 'api')
+            record_id = offline_storage.save_offline('/api/sensors/register', raw, DEST_API)
             if record_id:
-                gateway_stats['stored_offline'] += 1
-                logger.info(f"Registration saved to SQLite for sensor {machine_id}")
+                bump_stat('stored_offline')
+                logger.info("Registration saved to SQLite for sensor %s", machine_id)
                 return jsonify({
                     "status": "queued",
                     "message": f"API {Config.DATABASE_PI_API_URL} unavailable, registration queued in SQLite",
@@ -618,24 +1548,35 @@ def handle_sensor_registration():
                     "timestamp": datetime.now().isoformat()
                 }), 202
             else:
-                return jsonify({"error": "Failed to queue registration"}), 500
+                return overloaded_response()
             
     except Exception as e:
-        logger.error(f"Error handling registration: {e}")
+        logger.error("Error handling registration: %s", e)
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/api/sensors/<machine_id>/assignment', methods=['GET'])
 def handle_assignment_check(machine_id):
-    """Check sensor assignment status via Database Pi API"""
-    gateway_stats['requests_received'] += 1
+    """Check sensor assignment status via Database Pi API (cached for ASSIGNMENT_CACHE_TTL)"""
+    bump_stat('requests_received')
     
-    logger.info(f"Assignment check for sensor {machine_id}")
+    logger.info("Assignment check for sensor %s", machine_id)
+    
+    cached = get_cached_assignment_response(machine_id, Config.ASSIGNMENT_CACHE_TTL)
+    if cached is not None:
+        return jsonify(cached), 200
     
     # Try to call Database Pi API
     success, response = call_api(f'/api/sensors/{machine_id}/assignment', None, method='GET')
     
     if success:
+        cache_assignment_response(machine_id, response)
         return jsonify(response), 200
+    
+    # API down: the last known answer beats an error, assignments rarely change
+    stale = get_cached_assignment_response(machine_id, float('inf'))
+    if stale is not None:
+        logger.warning("API %s unavailable, serving cached assignment for %s", Config.DATABASE_PI_API_URL, machine_id)
+        return jsonify(stale), 200
     else:
         # For GET requests, try direct Database Pi MySQL check as fallback
         try:
@@ -649,7 +1590,7 @@ def handle_assignment_check(machine_id):
                     "mysql_host": Config.DB_CONFIG['host']
                 }), 404
         except Exception as e:
-            logger.warning(f"Could not check assignment for {machine_id} from {Config.DB_CONFIG['host']}: {e}")
+            logger.warning("Could not check assignment for %s from %s: %s", machine_id, Config.DB_CONFIG['host'], e)
             return jsonify({
                 "error": f"API {Config.DATABASE_PI_API_URL} and MySQL {Config.DB_CONFIG['host']} unavailable",
                 "machine_id": machine_id,
@@ -662,8 +1603,9 @@ def health_check():
     uptime = datetime.now() - gateway_stats['start_time']
     
     # Check health
-    mysql_healthy = check_mysql_health()
-    api_healthy = check_api_health()
+    force = request.args.get('force') == '1'
+    mysql_healthy = check_mysql_health(force)
+    api_healthy = check_api_health(force)
     
     health_data = {
         "gateway": {
@@ -691,6 +1633,10 @@ def health_check():
             "available": api_healthy,
             "last_check": gateway_stats['last_api_check'].isoformat() if gateway_stats['last_api_check'] else None
         },
+        "sensor_queue": {
+            "depth": ingest_queue_depth(),
+            "capacity": Config.SENSOR_QUEUE_SIZE
+        },
         "offline_queue": {
             "size": 0,
             "pending_mysql": 0,
@@ -700,22 +1646,10 @@ def health_check():
     
     # Get SQLite offline queue stats
     try:
-        conn = sqlite3.connect(Config.OFFLINE_STORAGE_PATH)
-        cursor = conn.cursor()
-        
-        # Total records
-        cursor.execute('SELECT COUNT(*) FROM offline_queue')
-        health_data['offline_queue']['size'] = cursor.fetchone()[0]
-        
-        # MySQL-bound pending
-        cursor.execute('SELECT COUNT(*) FROM offline_queue WHERE destination = "mysql" AND attempts < ?', (Config.MAX_RETRIES,))
-        health_data['offline_queue']['pending_mysql'] = cursor.fetchone()[0]
-        
-        # API-bound pending
-        cursor.execute('SELECT COUNT(*) FROM offline_queue WHERE destination = "api" AND attempts < ?', (Config.MAX_RETRIES,))
-        health_data['offline_queue']['pending_api'] = cursor.fetchone()[0]
-        
-        conn.close()
+        size, pending_mysql, pending_api = offline_storage.queue_counts(0 if force else Config.OFFLINE_COUNTS_TTL)
+        health_data['offline_queue']['size'] = size
+        health_data['offline_queue']['pending_mysql'] = pending_mysql
+        health_data['offline_queue']['pending_api'] = pending_api
     except:
         pass
     
@@ -758,8 +1692,56 @@ TO 'gateway_user'@'%';
 # ========================
 # MAIN APPLICATION
 # ========================
+def start_background_workers():
+    """Start the health refresher, sensor flusher and offline queue processor"""
+    health_refresher = Thread(target=refresh_health_status, daemon=True)
+    health_refresher.start()
+    
+    for shard in sensor_ingest_queues:
+        Thread(target=flush_sensor_queue, args=(shard,), daemon=True).start()
+    logger.info(f"{len(sensor_ingest_queues)} MySQL sensor data flushers started")
+    
+    queue_processor = Thread(target=run_offline_sync_when_leader, daemon=True)
+    queue_processor.start()
+
+def shutdown():
+    """Save readings still waiting for MySQL to SQLite and close every SQLite connection"""
+    pending = []
+    for shard in sensor_ingest_queues:
+        while True:
+            try:
+                pending.append(shard.get_nowait())
+            except queue.Empty:
+                break
+    if pending:
+        logger.info(f"Saving {len(pending)} queued readings to SQLite before exit")
+        store_sensor_rows_offline(pending)
+    
+    offline_storage.close_all()
+
+# Runs for both gunicorn workers and the dev server, before the log listener stops
+atexit.register(shutdown)
+
+def run_offline_sync_when_leader():
+    """Run process_offline_queue in exactly one gateway process
+    
+    Each gunicorn worker starts this; the one holding an exclusive flock on
+    SYNC_LOCK_PATH syncs the shared SQLite queue, the others keep retrying so
+    a replacement takes over if that worker exits (the kernel drops its lock).
+    """
+    lock_file = open(Config.SYNC_LOCK_PATH, 'w')
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            time.sleep(Config.BATCH_INTERVAL)
+    
+    logger.info(f"SQLite offline queue processor started (pid {os.getpid()})")
+    process_offline_queue()
+
 def main():
-    """Main gateway application entry point"""
+    """Development entry point - production runs under gunicorn via wsgi.py"""
     try:
         # Display setup reminder
         print("=" * 60)
@@ -775,14 +1757,8 @@ def main():
         print(f"   Database Pi API: {Config.DATABASE_PI_API_URL}")
         print("=" * 60)
         
-        # Initial health checks
-        check_mysql_health()
-        check_api_health()
-        
-        # Start offline queue processor
-        queue_processor = Thread(target=process_offline_queue, daemon=True)
-        queue_processor.start()
-        logger.info("SQLite offline queue processor started")
+        # Health refresher, sensor flusher and offline queue processor
+        start_background_workers()
         
         # Display startup information
         logger.info("=" * 60)
@@ -801,17 +1777,27 @@ def main():
         logger.info("   GET  /api/test               - Connectivity test")
         logger.info("=" * 60)
         logger.info("💾 Data Flow:")
-        logger.info(f"   Sensor Data → Database Pi MySQL ({Config.DB_CONFIG['host']})")
+        logger.info(f"   Sensor Data → Ingest queue → Batched into Database Pi MySQL ({Config.DB_CONFIG['host']})")
         logger.info("   If unavailable → SQLite offline → Sync when back online")
         logger.info("=" * 60)
         
-        # Start Flask application
-        app.run(
-            host=Config.GATEWAY_HOST,
-            port=Config.GATEWAY_PORT,
-            debug=False,
-            threaded=True
-        )
+        # Start Flask application - under waitress when installed (bounded thread
+        # pool, keep-alive), otherwise on Werkzeug's development server
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+        
+        if serve is not None:
+            serve(app, host=Config.GATEWAY_HOST, port=Config.GATEWAY_PORT, threads=Config.WSGI_THREADS)
+        else:
+            logger.warning("waitress not installed, using the Flask development server")
+            app.run(
+                host=Config.GATEWAY_HOST,
+                port=Config.GATEWAY_PORT,
+                debug=False,
+                threaded=True
+            )
         
     except Exception as e:
         logger.error(f"Gateway startup failed: {e}")
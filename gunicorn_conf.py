@@ -0,0 +1,24 @@
+"""
+Gunicorn settings for the Gateway Pi
+Run with: gunicorn -c gunicorn_conf.py wsgi:application
+
+gthread rather than gevent: the MySQL driver's C extension and sqlite3 block
+in C, which gevent's monkey-patching cannot make cooperative, so green threads
+would stall each other on every database call. Real threads release the GIL
+while waiting on MySQL, SQLite and the Database Pi API.
+"""
+import os
+
+bind = '0.0.0.0:5000'
+
+# One process is enough for a Pi 3; set GATEWAY_WORKERS on multi-core boards
+# that saturate a core. Only one worker runs the offline sync, and assignment
+# caches can lag a registration by up to their TTL in other workers (see wsgi.py).
+workers = int(os.environ.get('GATEWAY_WORKERS', '1'))
+worker_class = 'gthread'
+threads = 8  # Matches Config.WSGI_THREADS; DB_CONFIG['pool_size'] adds the 4 background MySQL users
+
+# Sensors post small bodies over keep-alive; reap idle connections quickly
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
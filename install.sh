@@ -189,6 +189,8 @@ install_with_retry() {
 install_with_retry "flask==2.3.3"
 install_with_retry "requests==2.31.0"
 install_with_retry "python-dotenv==1.0.0"
+install_with_retry "gunicorn==21.2.0"
+install_with_retry "orjson==3.9.10"
 
 # ========================
 # 8. GUARANTEE MYSQL-CONNECTOR-PYTHON INSTALLATION
@@ -247,6 +249,15 @@ else
     fi
 fi
 
+# The gateway uses the C extension (use_pure=False) for faster inserts
+if $mysql_connector_installed; then
+    if python -c "import mysql.connector, sys; sys.exit(not mysql.connector.HAVE_CEXT)" > /dev/null 2>&1; then
+        echo_green "    ✅ mysql-connector C extension available"
+    else
+        echo_yellow "    ⚠️  mysql-connector C extension missing - install libmysqlclient-dev and reinstall for faster inserts"
+    fi
+fi
+
 # ========================
 # 9. VERIFY ALL IMPORTS
 # ========================
@@ -265,6 +276,8 @@ print()
 tests = [
     ("flask", None),
     ("requests", None),
+    ("gunicorn", None),
+    ("orjson", None),
     ("mysql.connector", None),
     ("mysql.connector.pooling", "mysql.connector"),
     ("mysql.connector.Error", "mysql.connector"),
@@ -380,8 +393,8 @@ User=gateway
 Group=gateway
 WorkingDirectory=/home/gateway/soil-gateway
 
-# MUST use virtual environment Python
-ExecStart=$VENV_PATH/bin/python /home/gateway/soil-gateway/gateway.py
+# MUST use virtual environment - gunicorn serves wsgi.py (single worker, threaded)
+ExecStart=$VENV_PATH/bin/gunicorn -c gunicorn_conf.py wsgi:application
 
 Restart=always
 RestartSec=10
@@ -417,16 +430,13 @@ echo_blue "12. Setting up log rotation..."
 sudo tee /etc/logrotate.d/soil-gateway > /dev/null << EOF
 /home/gateway/soil_gateway_data/*.log /home/gateway/soil_gateway_logs/*.log {
     daily
+    maxsize 10M
     missingok
     rotate 14
     compress
     delaycompress
     notifempty
     create 644 gateway gateway
-    sharedscripts
-    postrotate
-        systemctl kill -s HUP soil-gateway.service 2>/dev/null || true
-    endscript
 }
 EOF
 
@@ -477,7 +487,7 @@ fi
 
 echo ""
 echo "3. Process Check:"
-if pgrep -f "gateway.py" >/dev/null; then
+if pgrep -f "wsgi:application" >/dev/null; then
     echo "   ✅ Gateway process running"
 else
     echo "   ❌ No gateway process found"
@@ -0,0 +1,22 @@
+"""
+WSGI entry point for the Gateway Pi
+Run with: gunicorn -c gunicorn_conf.py wsgi:application
+
+Each worker process gets its own ingest queue, MySQL pool and SQLite
+connections. Only one of them syncs the shared SQLite offline queue to
+Database Pi (see run_offline_sync_when_leader); gateway statistics in
+/api/health are per worker. Logging is safe to share: every worker appends
+to gateway.log and only logrotate rotates it.
+
+Assignment caches are per worker too. A registration clears them only in
+the worker that handled it; the others see the new assignment once their
+entry expires (UNKNOWN_SENSOR_CACHE_TTL for sensors cached as unknown or
+unassigned, ASSIGNMENT_CACHE_TTL otherwise).
+"""
+from gateway import app, start_background_workers
+
+# Imported after gunicorn forks (no --preload), so background threads and
+# MySQL/SQLite connections are never shared across processes
+start_background_workers()
+
+application = app